@@ -5,32 +5,163 @@
 
 This module is an implementation of the HMAC algorithm described by the
 standard <<Key hash message authentication code (HMAC) (FIPS PUB 198).>>
+The HMAC computation itself is delegated to the standard `hmac` module.
 
 """
 
 import hashlib
-from binascii import unhexlify, Error
-from _operator import _compare_digest as cmp
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+from typing import final
+from hmac import compare_digest as cmp, digest as hmac_digest, new as hmac_new
 
-# ipad and opad were chosen in order to have an important Hamming distance
-OPAD = bytes(i ^ 0x5c for i in range(256))
-IPAD = bytes(i ^ 0x36 for i in range(256))
+try:
+    import _hashlib
+except ImportError:  # Python built without OpenSSL
+    _hashlib = None
 
 
-def xor(key, pad):
-    """Make the XOR between key and pad
+def _constructor(name):
+    """Return the hash constructor for `name`, preferring the OpenSSL one.
+
+    Args:
+        name (str): A hash function name
+
+    Returns:
+        callable: The hash constructor
+    """
+    constructor = getattr(_hashlib, "openssl_" + name, None)
+    if constructor is None:
+        constructor = getattr(hashlib, name, None)
+    if constructor is None:
+        constructor = partial(hashlib.new, name)
+    return constructor
+
+
+# C implementation of `hmac.new()` over OpenSSL, if available
+OPENSSL_HMAC_NEW = getattr(_hashlib, "hmac_new", None)
+
+# Minimum number of pairs given to each `KHMAC.verify_many()` worker
+# process, smaller batches are verified in the calling process
+MIN_CHUNK_SIZE = 10000
+
+# Names of the supported hash functions, without the extendable-output
+# functions (shake_*) which have no fixed digest size for HMAC
+ALGORITHMS = frozenset(
+    name for name in hashlib.algorithms_available
+    if not name.startswith("shake_")
+)
+
+# Hash constructors resolved once, keyed by name
+CONSTRUCTORS = {name: _constructor(name) for name in ALGORITHMS}
+
+
+@lru_cache(maxsize=128)
+def _hash_name(hash_func):
+    """Return the name of a hash function, only instantiating it once.
+
+    Args:
+        hash_func (callable): The hash constructor
+
+    Returns:
+        str: The hash function name
+    """
+    return hash_func().name
+
+
+@lru_cache(maxsize=128)
+def _precomputed(hash_func, key):
+    """Build the HMAC object of a key, before any message.
+
+    The OpenSSL `HMAC_CTX` wrapper of `_hashlib` is used when it supports
+    the hash function, otherwise the `hmac.HMAC` object of the standard
+    `hmac` module.
+
+    The results are cached, so the key blocks are only hashed once per key.
+    The cache holds key material, see `KHMAC.clear_key_cache()`.
+
+    Args:
+        hash_func (callable): The hash constructor
+        key (bytes): The secret key
+
+    Returns:
+        (_hashlib.HMAC|hmac.HMAC): The keyed HMAC object, to be copied
+    """
+    if OPENSSL_HMAC_NEW is not None:
+        try:
+            return OPENSSL_HMAC_NEW(key, digestmod=hash_func)
+        except (TypeError, ValueError):  # Not an OpenSSL hash function
+            pass
+    return hmac_new(key, None, hash_func)
+
+
+def _compare(hmac, digest):
+    """Check in constant time that `hmac` matches `digest`.
+
+    Args:
+        hmac (KHMAC|bytes-like|str): A HMAC, binary or hexadecimal
+        digest (bytes): The expected digest
+
+    Returns:
+        bool: True if the HMACs are equal, else False
+    """
+    if isinstance(hmac, KHMAC):
+        hmac = hmac.digest()
+
+    if isinstance(hmac, str):
+        hmac = hmac.encode()
+    elif not isinstance(hmac, (bytes, bytearray)):
+        # Any other buffer, its length is then counted in bytes
+        hmac = memoryview(hmac).tobytes()
+
+    # Only a hexadecimal hmac has twice the digest size, it is compared
+    # to the hexadecimal digest rather than decoded
+    if len(hmac) == 2 * len(digest):
+        return cmp(hmac.lower(), digest.hex().encode())
+
+    return cmp(hmac, digest)
+
+
+# Key and hash function of a `KHMAC.verify_many()` worker process
+_WORKER_ARGS = None
+
+
+def _init_worker(key, hash_func):
+    """Store the key and hash function of a `KHMAC.verify_many()` worker.
+
+    """
+    global _WORKER_ARGS
+    _WORKER_ARGS = (key, hash_func)
+
+
+def _verify_pairs(key, hash_func, pairs):
+    """Verify (msg, hmac) pairs, all with the same key.
 
     Args:
         key (bytes|bytearray|str): The secret key
-        pad (bytes): Is equal to OPAD or IPAD
+        hash_func (str|callable): The hash function
+        pairs (list): The (msg, hmac) pairs to verify
 
     Returns:
-        (bytes|bytearray|str): XOR between key and pad
+        list: A boolean per pair
     """
-    return key.translate(pad)
+    digests = KHMAC.many(key, (msg for msg, _ in pairs), hash_func)
+    return [
+        _compare(hmac, digest) for (_, hmac), digest in zip(pairs, digests)
+    ]
+
+
+def _verify_chunk(pairs):
+    """Verify a chunk of (msg, hmac) pairs in a worker process.
+
+    """
+    return _verify_pairs(*_WORKER_ARGS, pairs)
 
 
 # KHMAC : keyed-hash message authentication code.
+@final
 class KHMAC:
     """KHMAC(key, msg, hash_func="sha1").
 
@@ -39,6 +170,8 @@ class KHMAC:
 
     """
 
+    __slots__ = ("__hmac", "hashname")
+
     def __init__(self, key: bytes, msg: bytes, hash_func="sha1"):
         """Create a new `KHMAC` object.
 
@@ -49,35 +182,113 @@ class KHMAC:
             hash_func: A hash function name.
 
         """
-        # Test if the key is a bytes or bytearray or str
-        if isinstance(key, str):
-            key = key.encode()
-        if not isinstance(key, (bytes, bytearray)):
-            raise TypeError("This key is not a bytes or a bytearray !")
+        key = self.__check_type_key(key)
+        if type(msg) is not bytes:
+            msg = self.__check_type_msg(msg)
+        hash_func = self.__check_hash_func(hash_func)
 
-        # Test if the message is a bytes or bytearray or str
-        msg = self.__check_type_msg(msg)
+        self.__hmac = _precomputed(hash_func, bytes(key)).copy()
+        if msg:
+            self.__hmac.update(msg)
 
-        # Test if the hash function is supported
-        if callable(hash_func):
-            pass
-        elif isinstance(hash_func, str) and hasattr(hashlib, hash_func):
-            hash_func = getattr(hashlib, hash_func)
-        else:
-            raise ValueError("unsupported hash type `{}`".format(hash_func))
+        # The hash function name
+        self.hashname = _hash_name(hash_func)
 
-        block_size = hash_func().block_size
+    @classmethod
+    def digest_oneshot(cls, key, msg, hash_func="sha1") -> bytes:
+        """Return the digest of `msg` for the given `key` and `hash_func`.
 
-        if len(key) > block_size:
-            key = hash_func(key).digest()
+        Mirrors `hmac.digest()`: no `KHMAC` object is built. The arguments
+        are checked like those of `KHMAC()`.
 
-        key = key.ljust(block_size, b'\0')
+        """
+        key = cls.__check_type_key(key)
+        msg = cls.__check_type_msg(msg)
+        hash_func = cls.__check_hash_func(hash_func)
+        return hmac_digest(key, msg, hash_func)
 
-        self.__block_1 = hash_func(xor(key, OPAD))
-        self.__block_2 = hash_func(xor(key, IPAD))
+    @classmethod
+    def many(cls, key, msgs, hash_func="sha1"):
+        """Return an iterator over the digest of each message of `msgs`,
+        all with the same key.
 
-        if msg:
-            self.update(msg)
+        The keyed HMAC object is built once and copied for every message,
+        which saves hashing the key blocks again for each one. The key and
+        the hash function are checked when `many()` is called.
+
+        """
+        khmac = cls(key, b"", hash_func)
+        template = khmac.__hmac
+
+        def digests():
+            for msg in msgs:
+                if type(msg) is not bytes:
+                    msg = khmac.__check_type_msg(msg)
+                hmac = template.copy()
+                hmac.update(msg)
+                yield hmac.digest()
+
+        return digests()
+
+    @classmethod
+    def verify_many(cls, key, pairs, hash_func="sha1", workers=None) -> list:
+        """Verify many (msg, hmac) pairs, all with the same key.
+
+        The pairs are split in chunks verified by a pool of `workers`
+        processes (`os.cpu_count()` by default), each chunk holding at
+        least `MIN_CHUNK_SIZE` pairs. Smaller batches are verified in the
+        calling process. Each worker receives the key once and MACs its
+        chunk like `KHMAC.many()`.
+
+        When a pool is used, the key, `hash_func` and the pairs are sent to
+        the workers, so they must be picklable: `hash_func` must be a name
+        or a module-level function (not a lambda), and the hmacs must be
+        bytes, bytearray or str. On platforms that spawn the workers (macOS,
+        Windows), each worker imports the caller's main module again, so
+        the calling script must guard its entry point with
+        `if __name__ == "__main__":`.
+
+        Returns:
+            list: A boolean per pair, true if the HMACs are equal.
+
+        """
+        # Check the key and the hash function before starting any worker
+        cls(key, b"", hash_func)
+
+        pairs = list(pairs)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(pairs) // MIN_CHUNK_SIZE)
+
+        if workers <= 1:
+            return _verify_pairs(key, hash_func, pairs)
+
+        # Fail here rather than in the workers of spawn platforms
+        try:
+            pickle.dumps(hash_func)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            raise TypeError(
+                "The hash function `{}` can not be sent to the worker "
+                "processes !".format(hash_func)
+            ) from None
+
+        size = -(-len(pairs) // workers)
+        chunks = [pairs[i:i + size] for i in range(0, len(pairs), size)]
+        with ProcessPoolExecutor(
+                workers, initializer=_init_worker, initargs=(key, hash_func)
+        ) as executor:
+            return [ok for chunk in executor.map(_verify_chunk, chunks)
+                    for ok in chunk]
+
+    @staticmethod
+    def clear_key_cache() -> None:
+        """Drop the cached HMAC objects of the recently used keys.
+
+        The cache is derived from the secret keys: clear it once they are
+        no longer needed.
+
+        """
+        _precomputed.cache_clear()
 
     def __str__(self):
         return "KHMAC({})".format(self.hexdigest())
@@ -85,31 +296,28 @@ class KHMAC:
     def __repr__(self):
         return self.__str__()
 
-    @property
-    def hashname(self):
-        """ Returns a hash function name.
-
-        """
-        return self.__block_1.name
-
     def copy(self):
         """Return a separate copy of this khmac object.
 
         """
         khmac = self.__class__.__new__(self.__class__)
-        khmac.__block_1 = self.__block_1.copy()
-        khmac.__block_2 = self.__block_2.copy()
+        khmac.hashname = self.hashname
+        khmac.__hmac = self.__hmac.copy()
         return khmac
 
-    def __finalize(self):
-        """ Return a `KHMAC` object for the current state
+    @staticmethod
+    def __check_type_key(key):
+        """ Check the type of key
 
         """
-        hmac = self.__block_1.copy()
-        hmac.update(self.__block_2.digest())
-        return hmac
+        if isinstance(key, str):
+            return key.encode()
+        if not isinstance(key, (bytes, bytearray)):
+            raise TypeError("This key is not a bytes or a bytearray !")
+        return key
 
-    def __check_type_msg(self, msg):
+    @staticmethod
+    def __check_type_msg(msg):
         """ Check the type of message
 
         """
@@ -119,18 +327,47 @@ class KHMAC:
             raise TypeError("This message is not a bytes or a bytearray !")
         return msg
 
+    @staticmethod
+    def __check_hash_func(hash_func):
+        """ Check that the hash function is supported, and return its
+        constructor
+
+        """
+        if callable(hash_func):
+            return hash_func
+        if isinstance(hash_func, str) and hash_func in ALGORITHMS:
+            return CONSTRUCTORS[hash_func]
+        raise ValueError("unsupported hash type `{}`".format(hash_func))
+
 
     def digest(self) -> bytes:
         """Return the digest value as a bytes object.
 
         """
-        return self.__finalize().digest()
+        return self.__hmac.digest()
+
+    def digest_into(self, out, offset=0) -> int:
+        """Write the digest value into `out`, a writable buffer such as a
+        bytearray, starting at byte `offset`. `out` must have at least the
+        digest size in bytes available past `offset`.
+
+        Returns:
+            int: The number of bytes written.
+
+        """
+        digest = self.digest()
+        size = len(digest)
+        with memoryview(out).cast("B") as view:
+            if offset < 0 or len(view) - offset < size:
+                raise ValueError("The buffer is too small for the digest !")
+            view[offset:offset + size] = digest
+        return size
 
     def hexdigest(self) -> str:
         """Return the digest value as a string of hexadecimal digits.
 
         """
-        return self.__finalize().hexdigest()
+        return self.__hmac.hexdigest()
 
     def update(self, msg) -> None:
         """Update the hmac object. Repeated calls are equivalent to a single
@@ -141,8 +378,12 @@ class KHMAC:
             >>> h.update(a+b)
 
         """
-        msg = self.__check_type_msg(msg)
-        self.__block_2.update(msg)
+        # Exact type checks are cheaper than `isinstance()` for the usual
+        # bytes chunks
+        if type(msg) is bytes or type(msg) is bytearray:
+            self.__hmac.update(msg)
+            return
+        self.__hmac.update(self.__check_type_msg(msg))
 
     def verify(self, hmac) -> bool:
         """Check the equality of HMACs.
@@ -150,16 +391,4 @@ class KHMAC:
         Returns:
             boolean: return true if the HMACs are equal, else return false.
         """
-        if isinstance(hmac, KHMAC):
-            hmac = hmac.digest()
-
-        if isinstance(hmac, str):
-            hmac = hmac.encode()
-
-        # Check if the hmac is hexadecimal
-        try:
-            hmac = unhexlify(hmac)
-        except Error:
-            pass
-
-        return cmp(hmac, self.digest())
+        return _compare(hmac, self.digest())
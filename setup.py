@@ -55,7 +55,7 @@ def main():
         # A long description will be displayed to present the lib
         long_description=readme(),
         # List the packages to insert in the distribution
-        packages=find_packages(),
+        packages=find_packages(exclude=("tests",)),
         # A list of strings or a comma-separated string providing
         # descriptive meta-data
         keywords="khmac, hmac, mac, python",
@@ -67,7 +67,7 @@ def main():
             "Natural Language :: English",
             "Operating System :: OS Independent",
         ],
-        python_requires='>=3.6',
+        python_requires='>=3.8',
     )
 
 
@@ -0,0 +1,164 @@
+""" Tests of the `KHMAC` class against the standard `hmac` module
+"""
+
+import hashlib
+import hmac
+import unittest
+from array import array
+
+from khmac import KHMAC
+from khmac import khmac as module
+
+
+KEY = b"my secret key"
+MSG = b"I am Mr. Yassin !"
+
+
+class TestKHMAC(unittest.TestCase):
+    """ Test the `KHMAC` class
+    """
+
+    def test_digest(self):
+        """ Test the digest() and hexdigest() methods
+        """
+        for name in ("sha1", "sha256", "sha512", "md5"):
+            expected = hmac.new(KEY, MSG, name)
+            khmac = KHMAC(KEY, MSG, name)
+            self.assertEqual(khmac.digest(), expected.digest())
+            self.assertEqual(khmac.hexdigest(), expected.hexdigest())
+            self.assertEqual(khmac.hashname, name)
+
+    def test_update_copy(self):
+        """ Test the update() and copy() methods
+        """
+        khmac = KHMAC(KEY.decode(), MSG.decode(), hashlib.blake2b)
+        expected = hmac.new(KEY, MSG, hashlib.blake2b)
+        copy = khmac.copy()
+        copy.update(bytearray(b"more"))
+        khmac.update("other")
+        expected_copy = expected.copy()
+        expected_copy.update(b"more")
+        expected.update(b"other")
+        self.assertEqual(khmac.digest(), expected.digest())
+        self.assertEqual(copy.digest(), expected_copy.digest())
+
+    def test_verify(self):
+        """ Test the verify() method
+        """
+        expected = hmac.new(KEY, MSG, "sha1")
+        khmac = KHMAC(KEY, MSG, "sha1")
+        hexdigest = expected.hexdigest().encode()
+        self.assertTrue(khmac.verify(expected.digest()))
+        self.assertTrue(khmac.verify(expected.hexdigest()))
+        self.assertTrue(khmac.verify(expected.hexdigest().upper()))
+        self.assertTrue(khmac.verify(bytearray(hexdigest)))
+        self.assertTrue(khmac.verify(memoryview(hexdigest)))
+        self.assertTrue(khmac.verify(memoryview(expected.digest())))
+        self.assertTrue(khmac.verify(array("I", expected.digest())))
+        self.assertTrue(khmac.verify(KHMAC(KEY, MSG, "sha1")))
+        self.assertFalse(khmac.verify(expected.digest()[:-1]))
+        self.assertFalse(khmac.verify(KHMAC(KEY, b"other", "sha1")))
+        self.assertRaises(TypeError, khmac.verify, 20)
+
+    def test_errors(self):
+        """ Test the errors raised for bad arguments
+        """
+        self.assertRaises(TypeError, KHMAC, 1, MSG)
+        self.assertRaises(TypeError, KHMAC, KEY, None)
+        self.assertRaises(ValueError, KHMAC, KEY, MSG, "bogus")
+
+    def test_algorithms(self):
+        """ Test the hash names accepted by `KHMAC`
+        """
+        expected = hmac.new(KEY, MSG, "sha512_256")
+        khmac = KHMAC(KEY, MSG, "sha512_256")
+        self.assertEqual(khmac.digest(), expected.digest())
+        self.assertEqual(khmac.hashname, "sha512_256")
+        self.assertRaises(ValueError, KHMAC, KEY, MSG, "new")
+        self.assertRaises(ValueError, KHMAC, KEY, MSG, "shake_128")
+        self.assertRaises(ValueError, KHMAC, KEY, MSG, "shake_256")
+
+    def test_digest_oneshot(self):
+        """ Test the digest_oneshot() class method
+        """
+        self.assertEqual(
+            KHMAC.digest_oneshot(KEY, MSG, "sha256"),
+            hmac.new(KEY, MSG, "sha256").digest()
+        )
+        self.assertEqual(
+            KHMAC.digest_oneshot(KEY.decode(), MSG.decode()),
+            hmac.new(KEY, MSG, "sha1").digest()
+        )
+        self.assertRaises(TypeError, KHMAC.digest_oneshot, 1, MSG)
+        self.assertRaises(TypeError, KHMAC.digest_oneshot, KEY, None)
+        self.assertRaises(
+            ValueError, KHMAC.digest_oneshot, KEY, MSG, "shake_128"
+        )
+        self.assertRaises(ValueError, KHMAC.digest_oneshot, KEY, MSG, "bogus")
+
+    def test_clear_key_cache(self):
+        """ Test the clear_key_cache() static method
+        """
+        KHMAC(KEY, MSG, "sha256")
+        self.assertGreater(module._precomputed.cache_info().currsize, 0)
+        KHMAC.clear_key_cache()
+        self.assertEqual(module._precomputed.cache_info().currsize, 0)
+
+    def test_many(self):
+        """ Test the many() class method
+        """
+        msgs = [b"", MSG, bytearray(b"x" * 300), "text"]
+        expected = [
+            hmac.new(KEY, msg.encode() if isinstance(msg, str) else msg,
+                     "sha256").digest()
+            for msg in msgs
+        ]
+        self.assertEqual(list(KHMAC.many(KEY, msgs, "sha256")), expected)
+        self.assertRaises(ValueError, KHMAC.many, KEY, msgs, "bogus")
+        self.assertRaises(TypeError, KHMAC.many, None, msgs)
+
+    def test_verify_many(self):
+        """ Test the verify_many() class method, serial and with a pool
+        """
+        msgs = [b"msg %d" % i for i in range(2 * module.MIN_CHUNK_SIZE)]
+        pairs = [
+            (msg, hmac.new(KEY, msg, "sha256").digest() if i % 3 else b"bad")
+            for i, msg in enumerate(msgs)
+        ]
+        pairs[1] = (msgs[1], hmac.new(KEY, msgs[1], "sha256").hexdigest())
+        expected = [bool(i % 3) for i in range(len(pairs))]
+        self.assertEqual(
+            KHMAC.verify_many(KEY, pairs, "sha256", workers=1), expected
+        )
+        self.assertEqual(
+            KHMAC.verify_many(KEY, pairs, "sha256", workers=2), expected
+        )
+        self.assertEqual(KHMAC.verify_many(KEY, [], "sha256"), [])
+
+    def test_verify_many_errors(self):
+        """ Test the errors raised by verify_many() before any worker starts
+        """
+        self.assertRaises(ValueError, KHMAC.verify_many, KEY, [], "bogus")
+        pairs = [(MSG, b"")] * (2 * module.MIN_CHUNK_SIZE)
+        self.assertRaises(
+            TypeError, KHMAC.verify_many, KEY, pairs,
+            lambda *args: hashlib.sha1(*args), workers=2
+        )
+
+
+    def test_digest_into(self):
+        """ Test the digest_into() method
+        """
+        khmac = KHMAC(KEY, MSG, "sha1")
+        digest = hmac.new(KEY, MSG, "sha1").digest()
+        out = bytearray(25)
+        self.assertEqual(khmac.digest_into(out, 5), len(digest))
+        self.assertEqual(bytes(out[5:]), digest)
+        out.append(0)  # the buffer is no longer exported
+        items = array("I", [0] * 5)
+        self.assertEqual(khmac.digest_into(items), len(digest))
+        self.assertEqual(items.tobytes(), digest)
+        self.assertRaises(ValueError, khmac.digest_into, bytearray(20), 1)
+
+if __name__ == "__main__":
+    unittest.main()